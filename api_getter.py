@@ -1,176 +1,419 @@
-import requests
-import requests
-import geopandas as gpd
-from shapely.geometry import Point, LineString, MultiLineString
+import gzip
+import hashlib
+import os
+import pickle
+import sys
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import ijson
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
 # === 1. Hàm tải dữ liệu Overpass API ===
-def overpass_query(query, attempts=3, pause=2.0):
-    url = "https://overpass-api.de/api/interpreter"
-    for attempt in range(attempts):
-        resp = requests.get(url, params={"data": query}, timeout=180)
-        if resp.status_code == 200:
-            return resp.json()
-        else:
-            time.sleep(pause)
+RETRY_AFTER_MAX = 120  # giây, chặn Retry-After quá dài từ máy chủ
+
+
+class _OverpassRetry(Retry):
+    """Retry chờ đúng Retry-After của Overpass (tối đa RETRY_AFTER_MAX) và in lý do."""
+
+    def get_retry_after(self, response):
+        wait = super().get_retry_after(response)
+        return None if wait is None else min(wait, RETRY_AFTER_MAX)
+
+    def sleep(self, response=None):
+        if response is not None:
+            wait = self.get_retry_after(response) if self.respect_retry_after_header else None
+            if wait is None:
+                wait = self.get_backoff_time()
+            print(f"⏳ Overpass {response.status}, thử lại sau {wait:.1f}s")
+        super().sleep(response)
+
+
+# Dùng chung một Session (keep-alive + connection pool) cho mọi truy vấn Overpass,
+# việc thử lại (kể cả 429 kèm Retry-After) do urllib3.Retry đảm nhiệm.
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    # Overpass queries are read-only, so the POST form is as safe to retry as GET
+    max_retries=_OverpassRetry(total=3, backoff_factor=2, status_forcelist=[429, 502, 503, 504],
+                               allowed_methods=frozenset({"GET", "POST"}),
+                               respect_retry_after_header=True),
+))
+
+
+OVERPASS_URL = "https://overpass-api.de/api/interpreter"
+
+# Bounding box: south, west, north, east (Hanoi-ish sample)
+BBOX = (20.8, 105.7, 21.3, 106.0)
+
+# Stops, relations and ways share the bbox, so one batched query saves an Overpass slot.
+# Relations only need their member list (out body); the member ways are pulled with way(r)
+# and carry their coordinates inline via out geom, so no (._;>;) node recursion is needed.
+# Filled with BUS_QUERY.format(*bbox).
+BUS_QUERY = """
+[out:json][timeout:180];
+relation["route"="bus"]({0},{1},{2},{3})->.routes;
+.routes out body;
+(
+  node["highway"="bus_stop"]({0},{1},{2},{3});
+  way(r.routes);
+  way["route"="bus"]({0},{1},{2},{3});
+);
+out geom;
+"""
+
+
+def overpass_query(query):
+    # POST form avoids URL length limits for the batched query; coordinate-heavy JSON
+    # compresses well, so ask for gzip/deflate on the wire
+    resp = SESSION.post(
+        OVERPASS_URL,
+        data={"data": query},
+        timeout=180,
+        headers={"Accept-Encoding": "gzip, deflate", "User-Agent": "hanoi-bus/1.0"},
+        stream=True,
+    )
     resp.raise_for_status()
+    return resp
 
 
-if __name__ == '__main__':
-    # Define bounding box: south, west, north, east (Hanoi-ish sample)
-    south, west, north, east = 20.8, 105.7, 21.3, 106.0
-
-    # === 2. Tải điểm dừng xe buýt ===
-    print("⬇️ Đang tải điểm dừng xe buýt từ OSM…")
-    bus_stop_query = f"""
-    [out:json][timeout:90];
-    node["highway"="bus_stop"]({south},{west},{north},{east});
-    out body;
-    """
-    data = overpass_query(bus_stop_query)
-    data_stops = data.get('elements', [])
+class _TeeReader:
+    """File-like wrapper that copies every chunk read from src into sink."""
 
-    stops_rows = []
-    for el in data_stops:
-        if el.get('type') != 'node':
-            continue
-        lon = el.get('lon')
-        lat = el.get('lat')
-        if lon is None or lat is None:
-            continue
-        stops_rows.append({
-            'id': el.get('id'),
-            'name': el.get('tags', {}).get('name', 'Không tên'),
-            'geometry': Point(lon, lat)
-        })
-
-    stops = gpd.GeoDataFrame(stops_rows, crs='EPSG:4326') if stops_rows else gpd.GeoDataFrame(columns=['id','name','geometry'], crs='EPSG:4326')
-    stops.to_file('hanoi_bus_stops_osm.geojson', driver='GeoJSON')
-    print(f"✅ Đã tải {len(stops)} điểm dừng xe buýt.\n")
+    def __init__(self, src, sink):
+        self.src = src
+        self.sink = sink
+
+    def read(self, size=-1):
+        chunk = self.src.read(size)
+        self.sink.write(chunk)
+        return chunk
+
+
+def iter_elements(resp, sink=None):
+    # Stream-parse the payload so only one element is materialized at a time
+    # instead of loading the whole (recursion-inflated) response with resp.json()
+    resp.raw.decode_content = True  # let urllib3 undo gzip before ijson reads the bytes
+    source = resp.raw if sink is None else _TeeReader(resp.raw, sink)
+    with resp:
+        yield from ijson.items(source, 'elements.item', use_float=True)
+        encoding = resp.headers.get('Content-Encoding', 'identity')
+        print(f"📦 Overpass: {resp.raw.tell() / 1e6:.1f} MB trên đường truyền ({encoding})")
+
+
+# Raw Overpass responses are cached on disk as gzip, keyed by the query hash
+OVERPASS_CACHE_DIR = os.path.join(".cache", "overpass")
+OVERPASS_CACHE_MAX_AGE_DAYS = 7
+
+
+def cached_elements(query, max_age_days=OVERPASS_CACHE_MAX_AGE_DAYS, force_refresh=False):
+    """Yield the elements of an Overpass query, from the disk cache when it is fresh enough."""
+    key = hashlib.sha256(query.encode('utf-8')).hexdigest()
+    path = os.path.join(OVERPASS_CACHE_DIR, f"{key}.json.gz")
+    if (not force_refresh and os.path.exists(path)
+            and time.time() - os.path.getmtime(path) < max_age_days * 86400):
+        print(f"📂 Dùng cache Overpass: {path}")
+        with gzip.open(path, 'rb') as fh:
+            yield from ijson.items(fh, 'elements.item', use_float=True)
+        return
 
-    # === 3. Tải tuyến xe buýt (ways / relations -> ways) ===
-    print("⬇️ Đang tải tuyến xe buýt từ OSM…")
-    # Request relations and ways in bbox, then expand members to get geometry (out geom)
-    bus_routes_query = f"""
-    [out:json][timeout:180];
-    (
-      relation["route"="bus"]({south},{west},{north},{east});
-      way["route"="bus"]({south},{west},{north},{east});
-    );
-    (._;>;);
-    out geom;
+    # Tee the streamed payload into a temp file; it only replaces the cache entry
+    # once the whole response has been read
+    os.makedirs(OVERPASS_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with gzip.open(tmp_path, 'wb') as sink:
+        yield from iter_elements(overpass_query(query), sink=sink)
+    os.replace(tmp_path, path)
+
+
+# Bbox is split into TILES = (nx, ny) sub-boxes queried concurrently; 1x1 is enough for Hanoi,
+# raise it for areas that would hit Overpass' 1GB/180s slot cap. Concurrency stays at 2 to
+# remain friendly with the public endpoint.
+TILES = (1, 1)
+MAX_CONCURRENT_REQUESTS = 2
+_overpass_slots = threading.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+
+def tile_bbox(south, west, north, east, nx, ny):
+    """Yield (south, west, north, east) sub-boxes covering the bbox on an nx × ny grid."""
+    dlat = (north - south) / ny
+    dlon = (east - west) / nx
+    for i in range(ny):
+        for j in range(nx):
+            yield (south + i * dlat, west + j * dlon, south + (i + 1) * dlat, west + (j + 1) * dlon)
+
+
+def fetch_elements(build_query, bbox, tiles=TILES, keep=None, force_refresh=False):
+    """Run build_query(south, west, north, east) on every tile and merge the elements.
+
+    keep filters elements inside each worker while streaming; elements returned by
+    several tiles are deduplicated by (type, id). force_refresh bypasses the disk cache.
     """
-    data = overpass_query(bus_routes_query)
-    elements = data.get('elements', [])
+    def _fetch(sub_bbox):
+        with _overpass_slots:
+            return [el for el in cached_elements(build_query(*sub_bbox), force_refresh=force_refresh)
+                    if keep is None or keep(el)]
+
+    sub_bboxes = list(tile_bbox(*bbox, *tiles))
+    elements = []
+    seen = set()
+    with ThreadPoolExecutor(max_workers=min(4, len(sub_bboxes))) as executor:
+        futures = [executor.submit(_fetch, sub) for sub in sub_bboxes]
+        for future in as_completed(futures):
+            for el in future.result():
+                key = (el.get('type'), el.get('id'))
+                if key in seen:
+                    continue
+                seen.add(key)
+                elements.append(el)
+    return elements
+
 
-    # Collect ways with geometry
-    ways = {el['id']: el for el in elements if el.get('type') == 'way' and 'geometry' in el}
 
+class SpatialIndex:
+    """STRtree over geometries whose tree positions map back to GeoDataFrame index labels."""
+
+    def __init__(self, geometries, index):
+        import shapely
+        self.tree = shapely.STRtree(np.asarray(geometries))
+        self.index = np.asarray(index)
+
+    @classmethod
+    def from_gdf(cls, gdf):
+        return cls(gdf.geometry.values, gdf.index.to_numpy())
+
+    def locate(self, lon, lat):
+        """Index labels of geometries whose bounding box contains the point."""
+        import shapely
+        return self.index[self.tree.query(shapely.points(lon, lat))]
+
+    def nearby(self, lon, lat, dist_deg):
+        """Index labels of geometries within dist_deg (degrees) of the point."""
+        import shapely
+        hits = self.tree.query(shapely.points(lon, lat), predicate='dwithin', distance=dist_deg)
+        return self.index[hits]
+
+    # Only plain arrays are pickled (an STRtree re-packs itself from its geometries when
+    # unpickled anyway), so the file loads no matter which module defined the class
+    def save(self, path):
+        with open(path, 'wb') as fh:
+            pickle.dump((self.tree.geometries, self.index), fh, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as fh:
+            geometries, index = pickle.load(fh)
+        return cls(geometries, index)
+
+
+def main():
+    south, west, north, east = BBOX
+
+    # === 2. Tải điểm dừng + tuyến xe buýt trong một truy vấn Overpass ===
+    print("⬇️ Đang tải điểm dừng và tuyến xe buýt từ OSM…")
+
+    # Only tagged bus stops are kept as stop nodes
+    def _is_wanted(el):
+        return el.get('type') != 'node' or el.get('tags', {}).get('highway') == 'bus_stop'
+
+    data_stops = []
+    ways = {}
+    relations = []
+    for el in fetch_elements(BUS_QUERY.format, BBOX, keep=_is_wanted):
+        el_type = el.get('type')
+        if el_type == 'node':
+            data_stops.append(el)
+        elif el_type == 'way':
+            if 'geometry' in el:
+                ways[el['id']] = el
+        elif el_type == 'relation':
+            relations.append(el)
+
+    # geopandas/pandas/shapely cost ~1s to import: load them only once the data is in,
+    # so importing this module (or a failed download) doesn't pay for them
+    import geopandas as gpd
+    import pandas as pd
+    import shapely
+
+    # Filter once, then build the columns with NumPy and the points with one shapely.points call
+    nodes = [el for el in data_stops
+             if el.get('lon') is not None and el.get('lat') is not None
+             # Safety net: keep only stops inside the bbox
+             and south <= el['lat'] <= north and west <= el['lon'] <= east]
+    ids = np.fromiter((el['id'] for el in nodes), dtype=np.int64, count=len(nodes))
+    lon = np.fromiter((el['lon'] for el in nodes), dtype=np.float64, count=len(nodes))
+    lat = np.fromiter((el['lat'] for el in nodes), dtype=np.float64, count=len(nodes))
+    # Names repeat a lot ("Không tên", shared stop names): intern them and keep a categorical column
+    names = [sys.intern(el.get('tags', {}).get('name', 'Không tên')) for el in nodes]
+
+    stops = gpd.GeoDataFrame({'id': ids, 'name': pd.Categorical(names)},
+                             geometry=shapely.points(lon, lat), crs='EPSG:4326')
+    stops.to_file('hanoi_bus_stops_osm.geojson', driver='GeoJSON', engine='pyogrio')
+    # GeoParquet copy: columnar, compressed and lossless, read back much faster than GeoJSON
+    stops.to_parquet('hanoi_bus_stops_osm.parquet')
+    print(f"✅ Đã tải {len(stops)} điểm dừng xe buýt.\n")
+
+    # === 3. Dựng tuyến xe buýt (ways / relations -> ways) ===
     routes_rows = []
 
+    def _way_coords(w):
+        # (n, 2) float64 lon/lat array straight from the way's inline geometry
+        geom = w['geometry']
+        return np.fromiter((v for pt in geom for v in (pt['lon'], pt['lat'])),
+                           dtype=np.float64, count=2 * len(geom)).reshape(-1, 2)
+
     # Helper to stitch way segments by matching endpoints into contiguous sequences
     def _stitch_segments(segments):
-        # segments: list of lists of (lon,lat) tuples
-        remaining = [list(seg) for seg in segments]
-        sequences = []
-        while remaining:
-            seq = remaining.pop(0)
-            changed = True
-            while changed:
-                changed = False
-                i = 0
-                while i < len(remaining):
-                    seg = remaining[i]
-                    if not seg:
-                        remaining.pop(i)
-                        continue
-                    # match end-to-start
-                    if seq[-1] == seg[0]:
-                        seq.extend(seg[1:])
-                        remaining.pop(i)
-                        changed = True
-                        continue
-                    # match end-to-end (reverse seg)
-                    if seq[-1] == seg[-1]:
-                        seq.extend(reversed(seg[:-1]))
-                        remaining.pop(i)
-                        changed = True
-                        continue
-                    # match start-to-end
-                    if seq[0] == seg[-1]:
-                        seq = seg[:-1] + seq
-                        remaining.pop(i)
-                        changed = True
-                        continue
-                    # match start-to-start (reverse seg)
-                    if seq[0] == seg[0]:
-                        seq = list(reversed(seg[1:])) + seq
-                        remaining.pop(i)
-                        changed = True
-                        continue
-                    i += 1
-            sequences.append(seq)
-        return sequences
+        # segments: list of (n, 2) lon/lat arrays
+        segments = [seg for seg in segments if len(seg)]
+        if not segments:
+            return []
+
+        # Canonicalize coordinates once: snap to OSM's 1e-7° grid and let np.unique assign a
+        # small integer node id per distinct point, so joins compare ints (and tolerate
+        # last-digit float noise) instead of hashing float tuples.
+        lengths = [len(seg) for seg in segments]
+        snapped = np.rint(np.vstack(segments) * 1e7).astype(np.int64)
+        unique, inverse = np.unique(snapped, axis=0, return_inverse=True)
+        node_seqs = np.split(inverse.ravel(), np.cumsum(lengths)[:-1])
+
+        # Open sequences are indexed by their two endpoint node ids, so every segment is
+        # spliced in with O(1) dict probes instead of rescanning all remaining segments.
+        seqs = {}        # seq_id -> deque of node ids
+        endpoints = {}   # node id -> (seq_id, 'head' | 'tail')
+
+        def _register(seq_id):
+            seq = seqs[seq_id]
+            if seq[0] == seq[-1]:
+                return  # closed ring, nothing left to join
+            endpoints[seq[0]] = (seq_id, 'head')
+            endpoints[seq[-1]] = (seq_id, 'tail')
+
+        def _unregister(seq_id):
+            seq = seqs[seq_id]
+            for key, end in ((seq[0], 'head'), (seq[-1], 'tail')):
+                if endpoints.get(key) == (seq_id, end):
+                    del endpoints[key]
+
+        def _attach(seq_id, end, seg):
+            # seg[0] coincides with the given end of the sequence
+            if end == 'tail':
+                seqs[seq_id].extend(seg[1:])
+            else:
+                seqs[seq_id].extendleft(seg[1:])
+
+        for seq_id, nodes in enumerate(node_seqs):
+            seg = nodes.tolist()
+            start_hit = endpoints.get(seg[0])
+            end_hit = endpoints.get(seg[-1]) if seg[-1] != seg[0] else None
+            if start_hit is None and end_hit is None:
+                seqs[seq_id] = deque(seg)
+                _register(seq_id)
+                continue
+            if start_hit is None:
+                # only the last point matches: flip so seg[0] is the shared one
+                seg.reverse()
+                start_hit, end_hit = end_hit, None
+
+            x_id, x_end = start_hit
+            _unregister(x_id)
+            _attach(x_id, x_end, seg)
+            if end_hit is not None and end_hit[0] != x_id:
+                # seg bridges two open sequences: fold the second one into the first
+                y_id, y_end = end_hit
+                _unregister(y_id)
+                other = seqs.pop(y_id)
+                if y_end == 'tail':
+                    other.reverse()
+                _attach(x_id, x_end, list(other))
+            _register(x_id)
+
+        # Materialize (n, 2) lon/lat arrays from the canonical grid points
+        coords = unique / 1e7
+        return [coords[np.fromiter(seq, dtype=np.intp, count=len(seq))] for seq in seqs.values()]
+
+    def _build_route_geoms(route_parts):
+        # route_parts: per route, a list of coordinate sequences with >= 2 points each.
+        # All vertices are packed into one (N, 2) array and turned into geometries with
+        # two vectorized Shapely calls instead of one LineString() per sequence.
+        parts = [seq for seqs in route_parts for seq in seqs]
+        coords = np.concatenate(parts)
+        lines = shapely.linestrings(coords, indices=np.repeat(np.arange(len(parts)), [len(seq) for seq in parts]))
+
+        counts = np.array([len(seqs) for seqs in route_parts])
+        multis = shapely.multilinestrings(lines, indices=np.repeat(np.arange(len(route_parts)), counts))
+        # Single-part routes stay plain LineStrings
+        first_part = np.cumsum(counts) - counts
+        return np.where(counts == 1, lines[first_part], multis)
+
+    # Ways already stitched into a relation are not emitted again as standalone routes
+    consumed_way_ids = set()
 
     # First, build routes from relations by concatenating member ways when possible
-    for el in elements:
-        if el.get('type') != 'relation':
-            continue
+    for el in relations:
         tags = el.get('tags', {})
-        name = tags.get('name', tags.get('ref', 'Không tên'))
+        name = sys.intern(tags.get('name', tags.get('ref', 'Không tên')))
         # collect way segments for this relation (preserve member order)
-        segments = []
-        for m in el.get('members', []):
-            if m.get('type') == 'way':
-                w = ways.get(m.get('ref'))
-                if w and 'geometry' in w:
-                    coords = [(pt['lon'], pt['lat']) for pt in w['geometry']]
-                    if len(coords) >= 2:
-                        segments.append(coords)
+        refs = [r for r in (m.get('ref') for m in el.get('members', ()) if m.get('type') == 'way')
+                if r in ways and len(ways[r]['geometry']) >= 2]
+        segments = [_way_coords(ways[r]) for r in refs]
+        consumed_way_ids.update(refs)
 
         if not segments:
             continue
 
         try:
-            stitched = _stitch_segments(segments)
-            # Create geometry: single LineString if one continuous sequence, else MultiLineString
-            if len(stitched) == 1:
-                geom = LineString(stitched[0])
-            else:
-                # ensure each sub-sequence has at least 2 points
-                multiline = [s for s in stitched if len(s) >= 2]
-                if len(multiline) == 1:
-                    geom = LineString(multiline[0])
-                else:
-                    geom = MultiLineString(multiline)
-
-            routes_rows.append({'id': el.get('id'), 'name': name, 'geometry': geom})
+            # A single continuous sequence becomes a LineString, several become a MultiLineString
+            parts = [seq for seq in _stitch_segments(segments) if len(seq) >= 2]
         except Exception:
             # fall back to naive concatenation
-            try:
-                flat = [pt for seg in segments for pt in seg]
-                if len(flat) >= 2:
-                    routes_rows.append({'id': el.get('id'), 'name': name, 'geometry': LineString(flat)})
-            except Exception:
-                pass
+            parts = [np.concatenate(segments)]
+        if parts:
+            routes_rows.append({'id': el.get('id'), 'name': name, 'parts': parts})
 
     # Also include standalone ways that are tagged as bus routes
+    seen_way_coords = set()  # drops identical ways exported more than once
     for w in ways.values():
+        if w['id'] in consumed_way_ids:
+            continue
         tags = w.get('tags', {})
         if tags.get('route') == 'bus' or 'route' in tags:
-            coords = [(pt['lon'], pt['lat']) for pt in w['geometry']]
+            coords = _way_coords(w)
+            coords_key = coords.tobytes()
+            if coords_key in seen_way_coords:
+                continue
+            seen_way_coords.add(coords_key)
             if len(coords) >= 2:
-                try:
-                    geom = LineString(coords)
-                    routes_rows.append({'id': w.get('id'), 'name': tags.get('name', tags.get('ref', 'Không tên')), 'geometry': geom})
-                except Exception:
-                    pass
-
-    routes_gdf = gpd.GeoDataFrame(routes_rows, crs='EPSG:4326') if routes_rows else gpd.GeoDataFrame(columns=['id','name','geometry'], crs='EPSG:4326')
-    routes_gdf.to_file('hanoi_bus_routes_osm.geojson', driver='GeoJSON')
+                routes_rows.append({'id': w.get('id'), 'name': sys.intern(tags.get('name', tags.get('ref', 'Không tên'))), 'parts': [coords]})
+
+    if routes_rows:
+        routes_gdf = gpd.GeoDataFrame(
+            {'id': [r['id'] for r in routes_rows], 'name': pd.Categorical([r['name'] for r in routes_rows])},
+            geometry=_build_route_geoms([r['parts'] for r in routes_rows]),
+            crs='EPSG:4326',
+        )
+    else:
+        routes_gdf = gpd.GeoDataFrame(columns=['id','name','geometry'], crs='EPSG:4326')
+    routes_gdf.to_file('hanoi_bus_routes_osm.geojson', driver='GeoJSON', engine='pyogrio')
+    routes_gdf.to_parquet('hanoi_bus_routes_osm.parquet')
+    # Persisted R-tree so consumers get O(log n) route lookups without rebuilding it
+    SpatialIndex.from_gdf(routes_gdf).save('hanoi_bus_routes.sindex.pkl')
     print(f"✅ Đã tải {len(routes_gdf)} tuyến xe buýt.\n")
 
     print("🎉 Hoàn tất! Dữ liệu OSM đã lưu:")
     print(" - hanoi_bus_stops_osm.geojson")
     print(" - hanoi_bus_routes_osm.geojson")
+    print(" - hanoi_bus_stops_osm.parquet")
+    print(" - hanoi_bus_routes_osm.parquet")
+    print(" - hanoi_bus_routes.sindex.pkl")
+
+
+if __name__ == '__main__':
+    main()
@@ -21,23 +21,91 @@ Date: December 2025
 
 import os
 import sys
+import base64
+import gzip
 import json
 import logging
 import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple, Any, Union
+from typing import Dict, List, Optional, Sequence, Tuple, Any, Union
 from dataclasses import dataclass, field
 from datetime import datetime
+from functools import lru_cache
 
 import geopandas as gpd
+import numpy as np
 import pandas as pd
+import shapely
 import folium
-from folium import Element, Icon, Marker, Tooltip, FeatureGroup
+from pyproj import CRS, Transformer
+from folium import Element, FeatureGroup, MacroElement
 from folium.plugins import (
-    Search, LocateControl, MarkerCluster, 
+    Search, LocateControl, FastMarkerCluster,
     MiniMap, Fullscreen, MousePosition, MeasureControl
 )
 
+from folium.template import Template
+
+from geo_io import READ_ENGINE, fresh_parquet, read_geodata
+
+# Optional C JSON codec (orjson.JSONDecodeError subclasses json.JSONDecodeError)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Optional brotli encoder for a pre-compressed <output>.br copy
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+if READ_ENGINE is not None:
+    # Also cover read_file calls that do not pass engine= explicitly
+    gpd.options.io_engine = READ_ENGINE
+
+# Compact JSON for everything folium embeds through |tojson (GeoJSON layers, cluster rows):
+# no spaces after separators and raw UTF-8 instead of \uXXXX escapes (the page is UTF-8).
+# Every folium Template shares one cached jinja environment, so the policy is only swapped
+# in for the duration of our own renders (see compact_tojson); <, >, & and ' are still escaped.
+_TEMPLATE_POLICIES = Template("").environment.policies
+_COMPACT_JSON_KWARGS = {"sort_keys": True, "separators": (",", ":"), "ensure_ascii": False}
+_TEMPLATE_POLICY_LOCK = threading.RLock()
+
+
+def _compact_dumps(obj: Any, **kwargs: Any) -> str:
+    """|tojson encoder: orjson for the compact policy, json.dumps for anything else.
+    
+    orjson output is already compact, key-sorted UTF-8, i.e. what json.dumps gives with
+    _COMPACT_JSON_KWARGS. Other kwargs (e.g. ``|tojson(indent=2)``) go to json.dumps.
+    """
+    if orjson is None or kwargs != _COMPACT_JSON_KWARGS:
+        return json.dumps(obj, **kwargs)
+    return orjson.dumps(
+        obj, option=orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+    ).decode("utf-8")
+
+
+@contextmanager
+def compact_tojson():
+    """Render folium templates with compact |tojson output, restoring the policies afterwards.
+    
+    Wrap ``get_root().render()`` calls in this; other users of folium in the same
+    process keep jinja's default JSON encoder and formatting.
+    """
+    with _TEMPLATE_POLICY_LOCK:
+        previous = (_TEMPLATE_POLICIES["json.dumps_kwargs"], _TEMPLATE_POLICIES["json.dumps_function"])
+        _TEMPLATE_POLICIES["json.dumps_kwargs"] = _COMPACT_JSON_KWARGS
+        _TEMPLATE_POLICIES["json.dumps_function"] = _compact_dumps
+        try:
+            yield
+        finally:
+            _TEMPLATE_POLICIES["json.dumps_kwargs"], _TEMPLATE_POLICIES["json.dumps_function"] = previous
+
+
 # ==================== CONFIGURATION ====================
 
 @dataclass
@@ -78,10 +146,18 @@ class MapConfig:
     enable_minimap: bool = True
     enable_measure: bool = True
     show_stops_by_default: bool = False
+    gzip_output: bool = True  # Also write a pre-compressed <output>.gz for static serving
+    brotli_output: bool = False  # Also write <output>.br (needs the optional brotli package)
+    parquet_cache: bool = True  # Save parsed GeoJSON as a <stem>.parquet sibling, reused while fresh
     
     # Route filtering
     route_buffer_distances: List[int] = field(default_factory=lambda: [50, 100, 200])
     
+    # Decimal places kept for coordinates embedded in the HTML (6 ≈ 0.1 m)
+    coordinate_precision: int = 6
+    # Douglas-Peucker tolerance (degrees) for route lines sent to the browser; 0 disables
+    route_simplify_tolerance: float = 0.0001
+    
     @classmethod
     def from_json(cls, json_path: str) -> 'MapConfig':
         """Load configuration from JSON file."""
@@ -125,18 +201,25 @@ logger = setup_logging()
 
 # ==================== UTILITY FUNCTIONS ====================
 
-def make_json_safe(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
-    """Convert all non-geometry columns to strings for JSON serialization.
+def make_json_safe(gdf: gpd.GeoDataFrame, keep_cols: Optional[Sequence[str]] = None) -> gpd.GeoDataFrame:
+    """Convert non-geometry columns to strings for JSON serialization.
     
     Args:
         gdf: Input GeoDataFrame
+        keep_cols: Attribute columns that will actually be rendered; all other
+            non-geometry columns are dropped. None keeps (and converts) every column.
         
     Returns:
         GeoDataFrame with string-converted columns
     """
-    for col in gdf.columns:
-        if col != "geometry":
-            gdf[col] = gdf[col].astype(str)
+    geometry_col = gdf.geometry.name
+    if keep_cols is not None:
+        gdf = gdf.drop(columns=[c for c in gdf.columns if c != geometry_col and c not in keep_cols])
+    # One astype over the columns that still need it (none when already converted)
+    to_cast = {col: "string" for col in gdf.columns
+               if col != geometry_col and gdf[col].dtype != pd.StringDtype()}
+    if to_cast:
+        gdf = gdf.astype(to_cast)
     return gdf
 
 
@@ -149,7 +232,7 @@ def validate_geojson_file(path: Union[str, Path]) -> bool:
     Returns:
         True if valid, False otherwise
     """
-    path = Path(path)
+    path = path if isinstance(path, Path) else Path(path)
     if not path.exists():
         logger.warning(f"File not found: {path}")
         return False
@@ -159,8 +242,8 @@ def validate_geojson_file(path: Union[str, Path]) -> bool:
         return False
     
     try:
-        with open(path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        raw = path.read_bytes()
+        data = orjson.loads(raw) if orjson is not None else json.loads(raw)
         if 'type' not in data or data['type'] not in ['FeatureCollection', 'Feature']:
             logger.warning(f"Invalid GeoJSON structure in {path}")
             return False
@@ -173,6 +256,36 @@ def validate_geojson_file(path: Union[str, Path]) -> bool:
         return False
 
 
+def round_coordinates(gdf: gpd.GeoDataFrame, decimals: int = 6) -> gpd.GeoDataFrame:
+    """Round geometry coordinates so the embedded GeoJSON stays compact.
+    
+    Args:
+        gdf: Input GeoDataFrame
+        decimals: Decimal places to keep
+        
+    Returns:
+        Copy of the GeoDataFrame with rounded coordinates
+    """
+    gdf = gdf.copy()
+    gdf[gdf.geometry.name] = gpd.GeoSeries(
+        shapely.transform(gdf.geometry.values, lambda coords: np.round(coords, decimals)),
+        index=gdf.index, crs=gdf.crs
+    )
+    return gdf
+
+
+@lru_cache(maxsize=32)
+def crs_epsg(crs: CRS) -> Optional[int]:
+    """EPSG code of a CRS, memoized (``CRS.to_epsg`` searches the PROJ database)."""
+    return crs.to_epsg()
+
+
+@lru_cache(maxsize=32)
+def get_transformer(src: CRS, target_epsg: int) -> Transformer:
+    """Shared lon/lat-ordered transformer for a (source CRS, target EPSG) pair."""
+    return Transformer.from_crs(src, CRS.from_epsg(target_epsg), always_xy=True)
+
+
 # ==================== CORE CLASSES ====================
 
 class GeoDataLoader:
@@ -180,50 +293,62 @@ class GeoDataLoader:
     
     def __init__(self, config: MapConfig):
         self.config = config
-        self._cache: Dict[str, Tuple[Dict, gpd.GeoDataFrame]] = {}
+        self._cache: Dict[str, gpd.GeoDataFrame] = {}
+        self._cache_lock = threading.Lock()
     
-    def load_geojson(self, path: Union[str, Path]) -> Tuple[Optional[Dict], Optional[gpd.GeoDataFrame]]:
+    def load_geojson(self, path: Union[str, Path]) -> Optional[gpd.GeoDataFrame]:
         """Load GeoJSON file with caching and validation.
         
+        A GeoJSON dict, when needed, comes from the frame's ``__geo_interface__``
+        instead of parsing the file a second time. With ``parquet_cache`` enabled
+        the parsed frame is also written to a ``<stem>.parquet`` sibling, which
+        later runs read instead while it is not older than the GeoJSON.
+        
         Args:
             path: Path to GeoJSON file
             
         Returns:
-            Tuple of (geojson_dict, GeoDataFrame) or (None, None) if failed
+            GeoDataFrame or None if failed
         """
-        path = Path(path)
-        path_str = str(path)
+        path = path if isinstance(path, Path) else Path(path)
+        path_str = os.fspath(path)
         
         # Check cache
         if path_str in self._cache:
             logger.debug(f"Loading from cache: {path.name}")
             return self._cache[path_str]
         
-        # Validate file
-        if not validate_geojson_file(path):
-            return None, None
+        parquet_fresh = self.config.parquet_cache and fresh_parquet(path) is not None
+        
+        # Validate file (already done when the snapshot was written)
+        if not parquet_fresh and not validate_geojson_file(path):
+            return None
         
         try:
             # Load as GeoDataFrame
-            gdf = gpd.read_file(path)
+            gdf = read_geodata(path, use_parquet=parquet_fresh)
             
             if gdf.empty:
                 logger.warning(f"Empty GeoDataFrame: {path.name}")
-                return None, None
+                return None
             
-            # Load as dict
-            with open(path, 'r', encoding='utf-8') as f:
-                geojson = json.load(f)
+            if self.config.parquet_cache and not parquet_fresh:
+                parquet_path = path.with_suffix('.parquet')
+                try:
+                    gdf.to_parquet(parquet_path)
+                except Exception as e:
+                    logger.warning(f"⚠️ Could not write GeoParquet cache {parquet_path.name}: {e}")
             
-            # Cache result
-            self._cache[path_str] = (geojson, gdf)
+            # Cache result (load_ward_stops calls this from worker threads)
+            with self._cache_lock:
+                self._cache[path_str] = gdf
             logger.info(f"✅ Loaded {len(gdf)} features from {path.name}")
             
-            return geojson, gdf
+            return gdf
             
         except Exception as e:
             logger.error(f"Failed to load {path}: {e}")
-            return None, None
+            return None
     
     def ensure_crs(self, gdf: gpd.GeoDataFrame, target_crs: int = 4326) -> gpd.GeoDataFrame:
         """Ensure GeoDataFrame has the correct CRS.
@@ -235,26 +360,37 @@ class GeoDataLoader:
         Returns:
             GeoDataFrame with correct CRS
         """
+        # Already in the target CRS (the usual case for OSM exports): return the frame as is
+        if gdf.crs is not None and crs_epsg(gdf.crs) == target_crs:
+            return gdf
         if gdf.crs is None:
             logger.warning("No CRS found, assuming EPSG:4326")
             gdf.set_crs(epsg=target_crs, inplace=True)
-        elif gdf.crs.to_epsg() != target_crs:
+        else:
             logger.debug(f"Reprojecting from {gdf.crs} to EPSG:{target_crs}")
-            gdf = gdf.to_crs(epsg=target_crs)
+            # Reuse one Transformer per CRS pair instead of building a new one per file
+            transformer = get_transformer(gdf.crs, target_crs)
+            geoms = shapely.transform(
+                gdf.geometry.values,
+                lambda coords: np.column_stack(transformer.transform(coords[:, 0], coords[:, 1]))
+            )
+            gdf = gdf.set_geometry(gpd.GeoSeries(geoms, index=gdf.index, crs=target_crs))
         return gdf
     
-    def load_ward_stops(self, folder_path: Union[str, Path]) -> Tuple[gpd.GeoDataFrame, List[Dict]]:
+    def load_ward_stops(self, folder_path: Union[str, Path]) -> Tuple[gpd.GeoDataFrame, pd.DataFrame]:
         """Load all ward bus stop files.
         
         Args:
             folder_path: Path to folder containing ward GeoJSON files
             
         Returns:
-            Tuple of (combined GeoDataFrame, list of features for search)
+            Tuple of (combined GeoDataFrame, point stops table with
+            lat/lon/name/ward columns for the map layers and search)
         """
         folder_path = Path(folder_path)
-        all_gdfs = []
-        all_features = []
+        geom_parts: List[np.ndarray] = []
+        name_parts: List[np.ndarray] = []
+        point_parts: List[pd.DataFrame] = []
         
         # Auto-discover all .geojson files if ward_files not specified
         ward_files = self.config.ward_files if self.config.ward_files else []
@@ -270,10 +406,15 @@ class GeoDataLoader:
                 logger.error(f"❌ Error scanning folder: {e}")
                 raise RuntimeError(f"Failed to scan folder: {e}")
         
-        for ward_file in ward_files:
-            full_path = folder_path / ward_file
-            _, gdf = self.load_geojson(str(full_path).replace('\\', '/'))
-            
+        # Read ward files concurrently (pyogrio releases the GIL during I/O);
+        # the processing below stays sequential
+        def read_ward(ward_file: str) -> Optional[gpd.GeoDataFrame]:
+            return self.load_geojson(folder_path / ward_file)
+        
+        with ThreadPoolExecutor(max_workers=max(1, min(8, len(ward_files)))) as executor:
+            ward_gdfs = list(executor.map(read_ward, ward_files))
+        
+        for ward_file, gdf in zip(ward_files, ward_gdfs):
             if gdf is None or gdf.empty:
                 continue
             
@@ -281,33 +422,127 @@ class GeoDataLoader:
             gdf = self.ensure_crs(gdf)
             
             # Make JSON-safe
-            gdf = make_json_safe(gdf)
-            all_gdfs.append(gdf)
+            gdf = make_json_safe(gdf, keep_cols=("name", "Name"))
+            geom_parts.append(np.asarray(gdf.geometry.values))
+            name_parts.append(gdf["name"].to_numpy(dtype=object) if "name" in gdf.columns
+                              else np.full(len(gdf), None, dtype=object))
             
-            # Extract features for search
-            for _, row in gdf.iterrows():
-                geom = row.geometry
-                if geom is None or geom.geom_type != "Point":
-                    continue
-                
-                name = (row.get("name") or row.get("Name") or "").strip()
-                if not name:
-                    name = f"Stop {len(all_features) + 1}"
-                
-                lat, lon = geom.y, geom.x
-                all_features.append({
-                    "type": "Feature",
-                    "geometry": {"type": "Point", "coordinates": [lon, lat]},
-                    "properties": {"name": name, "ward": ward_file.replace("Phường_", "").replace(".geojson", "").replace("_", " ")}
-                })
+            # Point stops as columns (no per-stop feature dicts)
+            is_point = gdf.geom_type.to_numpy() == "Point"
+            points = gdf.geometry[is_point]
+            names = gdf["name"] if "name" in gdf.columns else pd.Series("", index=gdf.index)
+            if "Name" in gdf.columns:
+                # Nullable "string" columns hold pd.NA, which has no truth value; test lengths instead
+                names = names.fillna("")
+                names = names.where(names.str.len() > 0, gdf["Name"])
+            names = names[is_point].fillna("").astype(str).str.strip()
+            ward = ward_file.replace("Phường_", "").replace(".geojson", "").replace("_", " ")
+
+            precision = self.config.coordinate_precision
+            point_parts.append(pd.DataFrame({
+                "lat": np.round(points.y.to_numpy(), precision),
+                "lon": np.round(points.x.to_numpy(), precision),
+                "name": names.to_numpy(dtype=object),
+                "ward": ward,
+            }))
         
-        if not all_gdfs:
+        if not geom_parts:
             raise RuntimeError("❌ No ward bus stop files found!")
         
-        combined = gpd.GeoDataFrame(pd.concat(all_gdfs, ignore_index=True))
+        # Concatenate the column arrays once instead of pd.concat over per-ward frames
+        combined = gpd.GeoDataFrame(
+            {"name": pd.array(np.concatenate(name_parts), dtype="string")},
+            geometry=gpd.GeoSeries(np.concatenate(geom_parts), crs="EPSG:4326"),
+        )
         logger.info(f"📊 Total stops loaded: {len(combined)}")
         
-        return combined, all_features
+        stop_points = (pd.concat(point_parts, ignore_index=True) if point_parts
+                       else pd.DataFrame(columns=["lat", "lon", "name", "ward"]))
+        unnamed = np.flatnonzero(stop_points["name"].to_numpy() == "")
+        stop_points.loc[unnamed, "name"] = [f"Stop {i + 1}" for i in unnamed]
+        
+        return combined, stop_points
+
+
+class BulkFastMarkerCluster(FastMarkerCluster):
+    """FastMarkerCluster that hands markers to the cluster in bulk ``addLayers`` calls.
+    
+    Leaflet.markercluster indexes a bulk ``addLayers`` in a single pass (and in chunks
+    with ``chunkedLoading``), instead of re-clustering after every ``addTo(cluster)``.
+    Markers are created ``chunk_size`` rows at a time from ``requestIdleCallback``
+    (with a 50 ms timeout, so loading still finishes on a busy page; ``setTimeout``
+    where unsupported) so the first paint is not blocked.
+    
+    Coordinates are shipped as one base64 little-endian Int32 blob of microdegrees
+    ``[lat, lon, ...]`` decoded into an ``Int32Array``: as compact as Float32, but the
+    6-decimal values shown in popups are exact. The remaining row fields stay JSON.
+    The callback still receives ``[lat, lon, *fields]`` rows in degrees.
+    """
+    
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function(){
+                var callback = {{ this.callback_js }};
+
+                var xy = (function (b64) {
+                    var bin = atob(b64), bytes = new Uint8Array(bin.length);
+                    for (var i = 0; i < bin.length; i++) { bytes[i] = bin.charCodeAt(i); }
+                    return new Int32Array(bytes.buffer);
+                })("{{ this.coords_b64 }}");
+                var data = {{ this.fields|tojson }};
+                var cluster = L.markerClusterGroup({{ this.options|tojavascript }});
+                {%- if this.icon_create_function is not none %}
+                cluster.options.iconCreateFunction =
+                    {{ this.icon_create_function.strip() }};
+                {%- endif %}
+
+                // timeout caps how long a chunk may wait on a busy page before it runs anyway
+                var schedule = window.requestIdleCallback
+                    ? function (fn) { return window.requestIdleCallback(fn, {timeout: 50}); }
+                    : function (fn) { return setTimeout(fn, 0); };
+                var chunkSize = {{ this.chunk_size }};
+                function addChunk(start) {
+                    var end = Math.min(start + chunkSize, data.length);
+                    var markers = new Array(end - start);
+                    for (var i = start; i < end; i++) {
+                        markers[i - start] = callback([xy[2 * i] / 1e6, xy[2 * i + 1] / 1e6].concat(data[i]));
+                    }
+                    cluster.addLayers(markers);
+                    if (end < data.length) {
+                        schedule(function () { addChunk(end); });
+                    }
+                }
+                schedule(function () { addChunk(0); });
+
+                cluster.addTo({{ this._parent.get_name() }});
+                return cluster;
+            })();
+        {% endmacro %}"""
+    )
+    
+    def __init__(self, data, callback: str, chunk_size: int = 200, **kwargs):
+        super().__init__(data, callback=callback, **kwargs)
+        self.callback_js = callback
+        self.chunk_size = int(chunk_size)
+        coords = np.rint(np.asarray([row[:2] for row in self.data], dtype=float).reshape(-1, 2) * 1e6).astype('<i4')
+        self.coords_b64 = base64.b64encode(coords.tobytes()).decode('ascii')
+        self.fields = [list(row[2:]) for row in self.data]
+
+
+class MapHandle(MacroElement):
+    """Publishes the parent map as ``window._busMap`` right after it is created.
+    
+    Page scripts (distance calculator, the Flask routing panel) look the map up
+    there instead of scanning every ``window`` property for a Leaflet instance.
+    """
+    
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            window._busMap = {{ this._parent.get_name() }};
+        {% endmacro %}"""
+    )
 
 
 class MapBuilder:
@@ -317,8 +552,45 @@ class MapBuilder:
         self.config = config
         self.loader = GeoDataLoader(config)
         self.map: Optional[folium.Map] = None
-        self.stops_gdf: Optional[gpd.GeoDataFrame] = None
-        self.features: List[Dict] = []
+        self._stops_gdf: Optional[gpd.GeoDataFrame] = None
+        self._stops_3857: Optional[gpd.GeoDataFrame] = None
+        self.stop_points: Optional[pd.DataFrame] = None
+        self._features: Optional[List[Dict]] = None
+        self.stops_layer: Optional[folium.GeoJson] = None
+    
+    @property
+    def stops_gdf(self) -> Optional[gpd.GeoDataFrame]:
+        """Loaded bus stops (EPSG:4326)."""
+        return self._stops_gdf
+    
+    @stops_gdf.setter
+    def stops_gdf(self, gdf: Optional[gpd.GeoDataFrame]) -> None:
+        self._stops_gdf = gdf
+        self._stops_3857 = None  # projected copy belongs to the previous stops
+    
+    @property
+    def features(self) -> List[Dict]:
+        """GeoJSON point features of ``stop_points``, built once on first use."""
+        if self._features is None:
+            self._features = [
+                {
+                    "type": "Feature",
+                    "geometry": {"type": "Point", "coordinates": [lon, lat]},
+                    "properties": {"name": name, "ward": ward}
+                }
+                for lat, lon, name, ward in self.stop_points.itertuples(index=False, name=None)
+            ]
+        return self._features
+    
+    def stops_projected(self) -> gpd.GeoDataFrame:
+        """Return the stops in EPSG:3857 (metres), projecting them only once per stops_gdf.
+        
+        Returns:
+            Cached projected copy of ``stops_gdf``
+        """
+        if self._stops_3857 is None:
+            self._stops_3857 = self.stops_gdf.to_crs(epsg=3857)
+        return self._stops_3857
     
     def create_base_map(self, center: List[float]) -> folium.Map:
         """Create base map with multiple tile layers.
@@ -335,17 +607,51 @@ class MapBuilder:
             tiles=None,
             prefer_canvas=True
         )
+        MapHandle().add_to(m)
+        
+        # Nothing on this page uses jQuery or Bootstrap's JS: skip two parser-blocking downloads
+        m.default_js = [(name, url) for name, url in m.default_js if name not in ('jquery', 'bootstrap')]
+        # Open connections to the plugin CDNs while the head is still being parsed
+        m.get_root().header.add_child(Element(''.join(
+            f'<link rel="preconnect" href="{host}">'
+            for host in ('https://cdn.jsdelivr.net', 'https://cdnjs.cloudflare.com')
+        )))
+        # The map box has a fixed size and clips its content: tell the browser so that pans and
+        # tile loads never trigger layout/paint outside it
+        m.get_root().header.add_child(Element(
+            '<style>.leaflet-container { contain: strict; }</style>'
+        ))
         
         # Add multiple tile layers
+        # All four providers serve 256 px tiles (CARTO's "@2x" is the same 256 px tile at
+        # retina density, picked by Leaflet's {r}). A provider with true 512 px tiles would get
+        # {'tile_size': 512, 'zoom_offset': -1, 'min_zoom': 1} here.
         tiles = [
-            ("CartoDB Voyager", "🗺️ Vibrant"),
-            ("CartoDB Positron", "⚪ Light"),
-            ("Esri.WorldImagery", "🛰️ Satellite"),
-            ("OpenStreetMap", "🌏 OSM"),
+            ("CartoDB Voyager", "🗺️ Vibrant", {}),
+            ("CartoDB Positron", "⚪ Light", {}),
+            ("Esri.WorldImagery", "🛰️ Satellite", {}),
+            ("OpenStreetMap", "🌏 OSM", {}),
         ]
         
-        for tile, name in tiles:
-            folium.TileLayer(tile, name=name).add_to(m)
+        # Keep more off-screen tiles in memory (Leaflet default: 2 rows) so panning back does not
+        # re-request them, and skip loading intermediate zoom levels during zoom animations
+        for tile, name, options in tiles:
+            folium.TileLayer(tile, name=name, keepBuffer=4, updateWhenZooming=False, **options).add_to(m)
+        
+        # Let the browser decode tile images off the main thread. Runs from the body, after
+        # leaflet.js has loaded and before the map script creates any tile layer.
+        m.get_root().html.add_child(Element("""
+        <script>
+        (function () {
+            var createTile = L.TileLayer.prototype.createTile;
+            L.TileLayer.prototype.createTile = function (coords, done) {
+                var tile = createTile.call(this, coords, done);
+                tile.decoding = 'async';
+                return tile;
+            };
+        })();
+        </script>
+        """))
         
         logger.info(f"✅ Base map created with {len(tiles)} tile layers")
         return m
@@ -363,26 +669,39 @@ class MapBuilder:
             logger.warning(f"Ward borders folder not found: {ward_border_folder}")
             return
         
-        for ward_file in self.config.ward_files:
-            border_path = ward_border_folder / ward_file
-            
+        # Read the border files concurrently (same as the ward stops); layers are still
+        # added in ward_files order below
+        def read_border(border_path: Path) -> Union[gpd.GeoDataFrame, Exception, None]:
             if not border_path.exists():
+                return None
+            try:
+                return gpd.read_file(border_path, engine=READ_ENGINE)
+            except Exception as e:
+                return e
+        
+        ward_files = self.config.ward_files
+        with ThreadPoolExecutor(max_workers=max(1, min(8, len(ward_files)))) as executor:
+            borders = list(executor.map(read_border, [ward_border_folder / wf for wf in ward_files]))
+        
+        for ward_file, gdf_border in zip(ward_files, borders):
+            if gdf_border is None:
                 logger.warning(f"Border file not found: {ward_file}")
                 continue
             
             try:
-                gdf_border = gpd.read_file(border_path)
+                if isinstance(gdf_border, Exception):
+                    raise gdf_border
                 if gdf_border.empty:
                     continue
                 
                 gdf_border = self.loader.ensure_crs(gdf_border)
-                gdf_border = make_json_safe(gdf_border)
+                gdf_border = make_json_safe(gdf_border, keep_cols=("name",))
                 
                 color = self.config.ward_colors.get(ward_file, "#ff7800")
                 ward_name = ward_file.replace("Phường_", "").replace(".geojson", "").replace("_", " ")
                 
                 folium.GeoJson(
-                    gdf_border.__geo_interface__,
+                    round_coordinates(gdf_border, self.config.coordinate_precision).__geo_interface__,
                     name=f"🗺️ {ward_name}",
                     style_function=lambda feat, col=color: {
                         "color": col,
@@ -409,50 +728,47 @@ class MapBuilder:
             raise RuntimeError("Map and stops not initialized.")
         
         if self.config.enable_clustering:
-            # Add clustered markers
-            marker_cluster = MarkerCluster(
+            # Clustered markers are built in the browser from a bare [lat, lon, name, ward]
+            # array, instead of rendering one Marker/Popup/Tooltip template per stop
+            data = self.stop_points[["lat", "lon", "name", "ward"]].to_numpy(dtype=object).tolist()
+            
+            # Same popup/tooltip/icon as the per-stop folium.Marker version. One icon is shared
+            # by all markers and the popup HTML is only built when a popup is actually opened.
+            callback = """
+            (function () {
+                var icon = L.AwesomeMarkers.icon({icon: 'bus', prefix: 'fa', markerColor: 'red'});
+                function popupHtml(row) {
+                    return '<div style="font-family: Arial; min-width: 200px;">'
+                        + '<h4 style="margin: 0 0 10px 0; color: #d32f2f;">🚌 ' + row[2] + '</h4>'
+                        + '<p style="margin: 5px 0;"><b>Ward:</b> ' + row[3] + '</p>'
+                        + '<p style="margin: 5px 0;"><b>Coordinates:</b><br>'
+                        + row[0].toFixed(6) + ', ' + row[1].toFixed(6) + '</p></div>';
+                }
+                return function (row) {
+                    var marker = L.marker(new L.LatLng(row[0], row[1]), {icon: icon});
+                    marker.bindPopup(function () { return popupHtml(row); }, {maxWidth: 300});
+                    // Plain stop name for tooltip (sticky keeps it near cursor)
+                    marker.bindTooltip(row[2], {sticky: true});
+                    return marker;
+                };
+            })()
+            """
+            
+            BulkFastMarkerCluster(
+                data,
+                callback=callback,
                 name="🚌 Bus Stops (Clustered)",
                 show=self.config.show_stops_by_default,
                 options={
                     'showCoverageOnHover': False,
                     'zoomToBoundsOnClick': True,
                     'spiderfyOnMaxZoom': True,
-                    'disableClusteringAtZoom': 16
+                    'disableClusteringAtZoom': 16,
+                    'chunkedLoading': True
                 }
             ).add_to(self.map)
             
-            for feat in self.features:
-                coords = feat['geometry']['coordinates']
-                props = feat['properties']
-                
-                # Enhanced popup with more details
-                popup_html = f"""
-                <div style="font-family: Arial; min-width: 200px;">
-                    <h4 style="margin: 0 0 10px 0; color: #d32f2f;">🚌 {props['name']}</h4>
-                    <p style="margin: 5px 0;"><b>Ward:</b> {props.get('ward', 'N/A')}</p>
-                    <p style="margin: 5px 0;"><b>Coordinates:</b><br>{coords[1]:.6f}, {coords[0]:.6f}</p>
-                </div>
-                """
-                
-                # Enhanced tooltip with HTML styling
-                tooltip_html = f"""
-                <div style="font-family: Arial; font-size: 12px;">
-                    <b>🚌 {props['name']}</b><br>
-                    <small style="color: #666;">{props.get('ward', 'N/A')}</small>
-                </div>
-                """
-                
-                # Build marker and explicitly attach a simple text tooltip (better cross-browser hover)
-                marker = folium.Marker(
-                    location=[coords[1], coords[0]],
-                    popup=folium.Popup(popup_html, max_width=300),
-                    icon=folium.Icon(color='red', icon='bus', prefix='fa')
-                )
-                # Use plain stop name for tooltip (sticky keeps it near cursor)
-                marker.add_child(folium.Tooltip(props.get('name', 'Stop'), sticky=True))
-                marker.add_to(marker_cluster)
-            
-            logger.info(f"✅ Added {len(self.features)} clustered bus stop markers")
+            logger.info(f"✅ Added {len(data)} clustered bus stop markers")
         else:
             # Add as GeoJSON layer with enhanced tooltip
             def style_function(feature):
@@ -463,10 +779,12 @@ class MapBuilder:
                     'fillOpacity': 0.6
                 }
             
-            search_layer = folium.GeoJson(
+            self.stops_layer = folium.GeoJson(
                 {"type": "FeatureCollection", "features": self.features},
                 name="🚌 Bus Stops",
-                marker=folium.Circle(radius=5, color='red', fill=True, fillColor='red', fillOpacity=0.6),
+                # Pixel-sized circleMarkers are drawn on the shared canvas renderer (prefer_canvas)
+                # instead of geodesic circles re-projected on every zoom
+                marker=folium.CircleMarker(radius=5, color='red', fill=True, fillColor='red', fillOpacity=0.6),
                 popup=folium.GeoJsonPopup(
                     fields=["name", "ward"],
                     aliases=["🚌 Stop Name:", "📍 Ward:"],
@@ -505,13 +823,20 @@ class MapBuilder:
             Path(__file__).parent / self.config.routes_file,
         ]
         
+        # Only read routes near the stops, and only the columns usable as the tooltip field.
+        # GeoJSON is always WGS84, so the window is the stops' bounds plus the widest buffer.
+        popup_candidates = ('ref', 'name', 'route', 'route_name')
+        minx, miny, maxx, maxy = self.stops_gdf.to_crs(epsg=4326).total_bounds
+        margin = max(self.config.route_buffer_distances, default=0) / (111_320 * math.cos(math.radians(maxy)))
+        route_bbox = (minx - margin, miny - margin, maxx + margin, maxy + margin)
+        
         route_gdf = None
         for route_path in possible_paths:
             if route_path.exists():
                 try:
-                    route_gdf = gpd.read_file(route_path)
+                    route_gdf = read_geodata(route_path, columns=list(popup_candidates), bbox=route_bbox)
                     route_gdf = self.loader.ensure_crs(route_gdf)
-                    route_gdf = make_json_safe(route_gdf)
+                    route_gdf = make_json_safe(route_gdf, keep_cols=popup_candidates)
                     logger.info(f"🚍 Loaded {len(route_gdf)} route features from {route_path.name}")
                     break
                 except Exception as e:
@@ -523,39 +848,57 @@ class MapBuilder:
         
         # Spatial filtering
         try:
-            stops_m = self.stops_gdf.to_crs(epsg=3857)
+            stops_m = self.stops_projected()
             routes_m = route_gdf.to_crs(epsg=3857)
             
+            # Query the stops' STRtree with each route (dwithin) instead of buffering and
+            # unioning every stop: only stops near a route's bbox are distance-tested
             selected_mask = None
             for radius in self.config.route_buffer_distances:
-                buf = stops_m.geometry.buffer(radius)
-                # Use union_all() instead of deprecated unary_union
-                try:
-                    union = buf.union_all()  # New method in geopandas >= 0.13
-                except AttributeError:
-                    union = buf.unary_union  # Fallback for older versions
-                mask = routes_m.geometry.intersects(union)
+                route_idx, _ = stops_m.sindex.query(routes_m.geometry, predicate='dwithin', distance=radius)
+                mask = np.zeros(len(routes_m), dtype=bool)
+                mask[route_idx] = True
                 if mask.any():
                     selected_mask = mask
                     logger.info(f"🚍 Found {int(mask.sum())}/{len(routes_m)} routes within {radius}m of stops")
                     break
             
-            filtered_routes = route_gdf.loc[selected_mask.values] if selected_mask is not None and selected_mask.any() else route_gdf
+            # route_gdf was already cut to the stops' bbox at read time, so the fallback is
+            # every route in that bbox, not every route in the file
+            if selected_mask is None:
+                logger.warning("No routes within the buffer distances. Using all routes in the stop bbox.")
+                filtered_routes = route_gdf
+            else:
+                filtered_routes = route_gdf.loc[selected_mask]
             
         except Exception as e:
-            logger.warning(f"Spatial filtering failed: {e}. Using all routes.")
+            logger.warning(f"Spatial filtering failed: {e}. Using all routes in the stop bbox.")
             filtered_routes = route_gdf
         
         # Find popup field
         popup_field = None
-        for col in ('ref', 'name', 'route', 'route_name'):
+        for col in popup_candidates:
             if col in filtered_routes.columns:
                 popup_field = col
                 break
         
-        # Add routes to map
+        # Drop vertices Leaflet cannot show at city zoom levels (~10 m at 1e-4°)
+        tolerance = self.config.route_simplify_tolerance
+        if tolerance > 0:
+            before = int(shapely.get_num_coordinates(filtered_routes.geometry.values).sum())
+            filtered_routes = filtered_routes.copy()
+            filtered_routes[filtered_routes.geometry.name] = filtered_routes.geometry.simplify(
+                tolerance, preserve_topology=False
+            )
+            after = int(shapely.get_num_coordinates(filtered_routes.geometry.values).sum())
+            logger.info(f"✂️ Simplified routes: {before} → {after} vertices")
+        
+        # Add routes to map (all routes go through one L.geoJson addData call; only the
+        # tooltip field is kept and per-feature bbox/id are dropped to keep that payload small)
+        route_columns = [popup_field, filtered_routes.geometry.name] if popup_field else [filtered_routes.geometry.name]
+        route_data = round_coordinates(filtered_routes[route_columns], self.config.coordinate_precision)
         folium.GeoJson(
-            filtered_routes.__geo_interface__,
+            route_data.to_geo_dict(show_bbox=False, drop_id=True),
             name='🚍 Bus Routes',
             style_function=lambda feat: {
                 'color': '#ff7800',
@@ -575,12 +918,22 @@ class MapBuilder:
         if self.map is None:
             raise RuntimeError("Map not initialized.")
         
-        # Create searchable GeoJSON layer
-        search_layer = folium.GeoJson(
-            {"type": "FeatureCollection", "features": self.features},
-            name="🔍 Search Layer",
-            show=False  # Hidden layer just for search
-        ).add_to(self.map)
+        # Reuse the GeoJSON stops layer when there is one, otherwise every stop would be
+        # embedded in the HTML a second time just for search
+        search_layer = self.stops_layer
+        if search_layer is None:
+            # Clustered stops cannot be indexed by Search, so a hidden layer is still needed;
+            # it only carries what Search reads (point + name), not the ward property
+            search_features = [
+                {"type": "Feature", "geometry": {"type": "Point", "coordinates": [lon, lat]},
+                 "properties": {"name": name}}
+                for lat, lon, name in self.stop_points[["lat", "lon", "name"]].itertuples(index=False, name=None)
+            ]
+            search_layer = folium.GeoJson(
+                {"type": "FeatureCollection", "features": search_features},
+                name="🔍 Search Layer",
+                show=False  # Hidden layer just for search
+            ).add_to(self.map)
         
         # Add search control
         Search(
@@ -643,10 +996,7 @@ class MapBuilder:
             return
         # Build statistics content (moved into a modal, triggered by a small button)
         total_stops = len(self.stops_gdf)
-        ward_counts = {}
-        for feat in self.features:
-            ward = feat['properties'].get('ward', 'Unknown')
-            ward_counts[ward] = ward_counts.get(ward, 0) + 1
+        ward_counts = self.stop_points["ward"].value_counts(sort=False).to_dict()
 
         # Modal + button HTML/CSS/JS
         stats_html = f"""
@@ -775,21 +1125,13 @@ class MapBuilder:
         
         // Listen for location events
         document.addEventListener('DOMContentLoaded', function() {
-            setTimeout(function() {
-                const map = window.dispatchEvent ? document.querySelector('.folium-map') : null;
-                if (map && map._leaflet_id) {
-                    const leafletMap = window[Object.keys(window).find(key => 
-                        window[key] && window[key]._container === map
-                    )];
-                    
-                    if (leafletMap) {
-                        leafletMap.on('locationfound', function(e) {
-                            window.userLocation = e.latlng;
-                            console.log('📍 User location:', e.latlng);
-                        });
-                    }
-                }
-            }, 1000);
+            const leafletMap = window._busMap;
+            if (leafletMap) {
+                leafletMap.on('locationfound', function(e) {
+                    window.userLocation = e.latlng;
+                    console.log('📍 User location:', e.latlng);
+                });
+            }
         });
         </script>
         """
@@ -808,10 +1150,20 @@ class MapBuilder:
         logger.info("=" * 60)
         
         # Load stops
-        self.stops_gdf, self.features = self.loader.load_ward_stops(self.config.folder_path)
+        self.stops_gdf, self.stop_points = self.loader.load_ward_stops(self.config.folder_path)
+        self._features = None
         
-        # Calculate center
-        center = [self.stops_gdf.geometry.y.mean(), self.stops_gdf.geometry.x.mean()]
+        # Calculate center: mean of the Point coordinates straight off the geometry array
+        # (no per-axis pandas Series), falling back to the bounds midpoint
+        geoms = self.stops_gdf.geometry.values
+        coords = shapely.get_coordinates(geoms[shapely.get_type_id(geoms) == 0])
+        if len(coords) == 0:
+            minx, miny, maxx, maxy = self.stops_gdf.total_bounds
+            center = [(miny + maxy) / 2, (minx + maxx) / 2]
+        else:
+            lon, lat = coords.mean(axis=0)
+            center = [float(lat), float(lon)]
+        center = [round(c, self.config.coordinate_precision) for c in center]
         logger.info(f"📍 Map center: {center[0]:.6f}, {center[1]:.6f}")
         
         # Create base map
@@ -847,9 +1199,26 @@ class MapBuilder:
             raise RuntimeError("Map not built. Call build() first.")
         
         output_path = Path(output_path or self.config.output_path)
-        self.map.save(str(output_path))
+        # Render once and reuse the string for both the plain and the gzipped copy
+        with compact_tojson():
+            data = self.map.get_root().render().encode('utf-8')
+        output_path.write_bytes(data)
         logger.info(f"💾 Map saved to: {output_path.absolute()}")
         
+        if self.config.gzip_output:
+            gz_path = output_path.with_name(output_path.name + '.gz')
+            with gzip.open(gz_path, 'wb', compresslevel=6) as f:
+                f.write(data)
+            logger.info(f"🗜️ Compressed copy: {gz_path.name} ({gz_path.stat().st_size / 1e6:.2f} MB)")
+        
+        if self.config.brotli_output:
+            if brotli is None:
+                logger.warning("⚠️ brotli_output is set but brotli is not installed (pip install brotli), skipping .br output")
+            else:
+                br_path = output_path.with_name(output_path.name + '.br')
+                br_path.write_bytes(brotli.compress(data, quality=5))
+                logger.info(f"🗜️ Compressed copy: {br_path.name} ({br_path.stat().st_size / 1e6:.2f} MB)")
+        
         return output_path
 
 
@@ -932,6 +1301,16 @@ Examples:
         action="store_true",
         help="Disable mini-map"
     )
+    parser.add_argument(
+        "--no-gzip",
+        action="store_true",
+        help="Do not write the compressed .html.gz copy"
+    )
+    parser.add_argument(
+        "--brotli",
+        action="store_true",
+        help="Also write a compressed .html.br copy (requires the brotli package)"
+    )
     parser.add_argument(
         "--show-stops",
         action="store_true",
@@ -961,6 +1340,8 @@ Examples:
     config.enable_clustering = not args.no_clustering
     config.enable_statistics = not args.no_stats
     config.enable_minimap = not args.no_minimap
+    config.gzip_output = not args.no_gzip
+    config.brotli_output = args.brotli
     config.show_stops_by_default = args.show_stops
     
     # Build map
@@ -1,9 +1,34 @@
-from flask import Flask, render_template_string, send_from_directory, request, jsonify
+from flask import Flask, Response, render_template_string, send_from_directory, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 import os
-from bus_map import build_bus_map  # 👈 import your 3-ward version
+import threading
+from bus_map import build_bus_map, compact_tojson  # 👈 import your 3-ward version
 from bus_routing import BusRoutingEngine
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """jsonify via orjson (C encoder) - /find_route trả về mảng tọa độ lớn."""
+
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if kwargs.get("sort_keys", self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+if orjson is not None:
+    app.json = ORJSONProvider(app)
 
 # Folder containing the 3 GeoJSON ward files
 WARD_FOLDER = os.path.abspath(os.path.join(os.path.dirname(__file__), "district_bus_stops"))
@@ -163,6 +188,15 @@ TEMPLATE = """
     </div>
 
     <script>
+        // Gom các lần gọi liên tiếp, chỉ chạy lần cuối sau `ms` mili giây
+        function debounce(fn, ms) {
+            let t;
+            return function(...args) {
+                clearTimeout(t);
+                t = setTimeout(() => fn.apply(this, args), ms);
+            };
+        }
+
         function useCurrentLocation() {
             const startInput = document.getElementById('start');
             const originalPlaceholder = startInput.placeholder;
@@ -179,14 +213,8 @@ TEMPLATE = """
                 return;
             }
 
-            // Tìm đối tượng bản đồ Leaflet trong iframe
-            let mapInstance = null;
-            for (let key in iframeWin) {
-                if (iframeWin.hasOwnProperty(key) && iframeWin[key] instanceof iframeWin.L.Map) {
-                    mapInstance = iframeWin[key];
-                    break;
-                }
-            }
+            // Đối tượng bản đồ Leaflet được bus_map gán sẵn vào window._busMap trong iframe
+            const mapInstance = iframeWin._busMap;
 
             if (!mapInstance) {
                 alert("Không tìm thấy đối tượng bản đồ.");
@@ -277,7 +305,7 @@ TEMPLATE = """
 
         function autocomplete(inp) {
             var currentFocus;
-            inp.addEventListener("input", function(e) {
+            inp.addEventListener("input", debounce(function(e) {
                 var a, b, i, val = this.value;
                 closeAllLists();
                 if (!val) { return false;}
@@ -291,6 +319,8 @@ TEMPLATE = """
                 fetch(`/search_stops?q=${encodeURIComponent(val)}`)
                     .then(response => response.json())
                     .then(arr => {
+                        // Bỏ qua kết quả cũ nếu người dùng đã gõ tiếp
+                        if (inp.value !== val) return;
                         // Xóa danh sách cũ nếu API trả về chậm
                         a.innerHTML = '';
                         for (i = 0; i < arr.length; i++) {
@@ -314,7 +344,7 @@ TEMPLATE = """
                             a.appendChild(b);
                         }
                     });
-            });
+            }, 200));
             
             inp.addEventListener("keydown", function(e) {
                 var x = document.getElementById(this.id + "autocomplete-list");
@@ -416,35 +446,31 @@ TEMPLATE = """
             const iframe = document.querySelector('iframe');
             const iframeWindow = iframe.contentWindow;
 
-            // Tìm đối tượng bản đồ Leaflet trong iframe
-            let mapInstance = null;
-            for (const key in iframeWindow) {
-                if (iframeWindow[key] && iframeWindow[key].removeLayer && iframeWindow[key].fitBounds) {
-                    mapInstance = iframeWindow[key];
-                    break;
-                }
-            }
+            // Đối tượng bản đồ Leaflet được bus_map gán sẵn vào window._busMap trong iframe
+            const mapInstance = iframeWindow._busMap;
 
             if (mapInstance) {
                 const L = iframeWindow.L;
                 if (!L) return;
 
-                // Xóa đường cũ nếu có
+                // Dùng lại đường cũ (setLatLngs) thay vì xóa rồi tạo polyline mới mỗi lần tìm
                 if (iframeWindow.currentRouteLayer) {
-                    mapInstance.removeLayer(iframeWindow.currentRouteLayer);
+                    iframeWindow.currentRouteLayer.setLatLngs(coords);
+                } else {
+                    // Vẽ đường mới màu xanh dương
+                    iframeWindow.currentRouteLayer = L.polyline(coords, {
+                        color: 'blue',
+                        weight: 5,
+                        opacity: 0.7
+                    }).addTo(mapInstance);
                 }
-                // Xóa các marker cũ
+                // Các marker nằm chung một layerGroup, xóa marker cũ bằng một lần clearLayers()
                 if (iframeWindow.currentMarkers) {
-                    iframeWindow.currentMarkers.forEach(m => mapInstance.removeLayer(m));
+                    iframeWindow.currentMarkers.clearLayers();
+                } else {
+                    iframeWindow.currentMarkers = L.layerGroup().addTo(mapInstance);
                 }
-                iframeWindow.currentMarkers = [];
-
-                // Vẽ đường mới màu xanh dương
-                iframeWindow.currentRouteLayer = L.polyline(coords, {
-                    color: 'blue',
-                    weight: 5,
-                    opacity: 0.7
-                }).addTo(mapInstance);
+                const markerGroup = iframeWindow.currentMarkers;
 
                 // Vẽ marker cho các điểm chuyển tuyến (Start/End của mỗi segment)
                 if (segments && segments.length > 0) {
@@ -476,24 +502,22 @@ TEMPLATE = """
                         });
 
                         const marker = L.marker([seg.start_lat, seg.start_lon], {title: markerTitle, icon: customIcon})
-                            .addTo(mapInstance)
+                            .addTo(markerGroup)
                             .bindPopup(popupContent);
                         
                         if (index === 0) marker.openPopup();
-                        iframeWindow.currentMarkers.push(marker);
 
                         // Thêm mũi tên chỉ hướng (Text label trên đường)
                         // Lấy điểm giữa của chặng để đặt nhãn tên tuyến
                         // Đây là cách đơn giản để hiển thị "Hướng đi"
-                        const midLabel = L.marker([seg.start_lat, seg.start_lon], {
+                        L.marker([seg.start_lat, seg.start_lon], {
                             icon: L.divIcon({
                                 className: 'route-label',
                                 html: `<div style="background: white; padding: 2px 5px; border: 1px solid #3498db; border-radius: 4px; font-size: 10px; color: #3498db; white-space: nowrap; box-shadow: 0 1px 3px rgba(0,0,0,0.2);">➡ ${seg.route}</div>`,
                                 iconSize: [60, 20],
                                 iconAnchor: [-20, 20] // Offset một chút để không che marker
                             })
-                        }).addTo(mapInstance);
-                        iframeWindow.currentMarkers.push(midLabel);
+                        }).addTo(markerGroup);
 
 
                         // Nếu là chặng cuối, thêm marker cho điểm kết thúc
@@ -506,10 +530,9 @@ TEMPLATE = """
                                 iconAnchor: [8, 8]
                             });
 
-                             const endMarker = L.marker([seg.end_lat, seg.end_lon], {title: "Đích đến", icon: endIcon})
-                                .addTo(mapInstance)
+                             L.marker([seg.end_lat, seg.end_lon], {title: "Đích đến", icon: endIcon})
+                                .addTo(markerGroup)
                                 .bindPopup(`<b>🏁 Đích đến:</b> ${seg.end_stop}`);
-                            iframeWindow.currentMarkers.push(endMarker);
                         }
                     });
                 }
@@ -558,11 +581,8 @@ def search_stops():
     if router.stops_gdf is None:
         return jsonify([])
         
-    # Lọc các trạm có tên chứa query
-    matches = router.stops_gdf[router.stops_gdf['name'].str.lower().str.contains(query, na=False)]
-    
-    # Lấy danh sách tên duy nhất (để tránh trùng lặp) và giới hạn số lượng
-    results = matches['name'].unique().tolist()[:10]
+    # Lọc các trạm có tên chứa query trên chỉ mục tên dựng sẵn (tên duy nhất, tối đa 10)
+    results = router.search_stop_names(query, limit=10)
     
     return jsonify(results)
 
@@ -584,12 +604,37 @@ def find_nearest_stop():
         return jsonify({"error": str(e)}), 500
 
 
+# HTML bản đồ đã render, khóa theo mtime của dữ liệu nguồn
+_MAP_HTML_CACHE = {}
+_MAP_HTML_LOCK = threading.Lock()
+
+
+def _map_source_mtime():
+    """Latest mtime among the ward GeoJSON files and the routes file."""
+    mtimes = [entry.stat().st_mtime for entry in os.scandir(WARD_FOLDER)
+              if entry.name.lower().endswith(".geojson")]
+    if os.path.exists(ROUTES_FILE):
+        mtimes.append(os.path.getmtime(ROUTES_FILE))
+    return max(mtimes, default=0.0)
+
+
 @app.route("/map_embed")
 def map_embed():
-    """Generate and serve the Folium map dynamically."""
-    print("🛠 Generating Folium map...")
-    folium_map = build_bus_map(WARD_FOLDER)
-    return folium_map.get_root().render()
+    """Serve the Folium map, rebuilding it only when the source data changed."""
+    key = _map_source_mtime()
+    html = _MAP_HTML_CACHE.get(key)
+    if html is None:
+        with _MAP_HTML_LOCK:
+            # Request khác có thể vừa dựng xong trong lúc chờ khóa
+            html = _MAP_HTML_CACHE.get(key)
+            if html is None:
+                print("🛠 Generating Folium map...")
+                folium_map = build_bus_map(WARD_FOLDER)
+                with compact_tojson():
+                    html = folium_map.get_root().render()
+                _MAP_HTML_CACHE.clear()  # chỉ giữ bản ứng với dữ liệu hiện tại
+                _MAP_HTML_CACHE[key] = html
+    return Response(html, mimetype="text/html")
 
 
 @app.route("/data/<path:filename>")
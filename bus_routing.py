@@ -1,15 +1,22 @@
+import bisect
 import json
 import os
+from collections import OrderedDict, defaultdict
 import networkx as nx
-import geopandas as gpd
+import shapely
 from shapely.geometry import LineString, Point, MultiLineString
 from shapely.ops import substring, linemerge
+import numpy as np
 import pandas as pd
 import warnings
 
+# Đọc GeoJSON (ưu tiên bản GeoParquet cùng tên nếu không cũ hơn), engine pyogrio nếu có
+from geo_io import read_geodata
+
 # Tắt cảnh báo của pandas/geopandas để output sạch hơn
 warnings.filterwarnings("ignore")
 
+
 class BusRoutingEngine:
     def __init__(self, stops_file, routes_file):
         self.stops_file = stops_file
@@ -19,8 +26,14 @@ class BusRoutingEngine:
         self.routes_gdf = None
         self.is_built = False
         self.route_to_stops = {}  # Map: route_name -> list of stop_ids
+        self.stop_to_routes = {}  # Map: stop_id -> {route_name: vị trí đầu tiên trong route_to_stops}
         self.max_walk_distance_m = 120  # Khoảng cách tối đa để tạo kết nối đi bộ
         self.side_eps = 0.0001          # Bước lấy hướng tuyến để xác định bên đường
+        self.simplify_tolerance = 0.00001  # Sai số Douglas-Peucker (~1m) khi lưu hình học cạnh để vẽ
+        self.node_name_index = []       # [(stop_id, tên viết thường)] dựng một lần sau khi build graph
+        self._name_match_cache = OrderedDict()  # LRU: tên tìm kiếm (viết thường) -> tuple node khớp
+        self.name_match_cache_size = 65536      # Giới hạn số truy vấn được nhớ (khóa là input người dùng)
+        self._stop_name_index = None    # (tên gốc, offset, chuỗi tên viết thường nối bằng \x01) cho autocomplete
 
 
 
@@ -32,25 +45,75 @@ class BusRoutingEngine:
             
         # Tạo điểm từ tọa độ (Lưu ý: GeoJSON dùng lon, lat)
         point = Point(lon, lat)
-        
-        # Tính khoảng cách đến tất cả các trạm (đơn vị độ)
-        # Để tối ưu, có thể dùng sindex nearest, nhưng với số lượng trạm nhỏ (<5000) thì tính hết cũng nhanh
-        distances = self.stops_gdf.geometry.distance(point)
-        
-        # Lấy top 'limit' trạm gần nhất
-        nearest_indices = distances.nsmallest(limit).index
-        nearest_stops = self.stops_gdf.loc[nearest_indices]
+        geoms = self.stops_gdf.geometry
+
+        # Dùng sindex (STRtree) lấy ứng viên trong bán kính r, nới r gấp đôi đến khi đủ 'limit' trạm.
+        # Mọi trạm ngoài r đều xa hơn mọi trạm trong r nên top 'limit' trong ứng viên cũng là top toàn cục.
+        if geoms.empty or not (np.isfinite(lat) and np.isfinite(lon)):
+            return []
+        minx, miny, maxx, maxy = geoms.total_bounds
+        max_radius = np.hypot(max(maxx, lon) - min(minx, lon), max(maxy, lat) - min(miny, lat))
+        # Không có hình học hợp lệ (total_bounds NaN): không có bán kính dừng, trả về rỗng
+        if not np.isfinite(max_radius):
+            return []
+        radius = 0.002  # ~200m
+        while True:
+            candidates = np.sort(geoms.sindex.query(point, predicate='dwithin', distance=radius))
+            if len(candidates) >= limit or radius >= max_radius:
+                break
+            # Không vượt quá max_radius, nên vòng lặp chắc chắn dừng ở lần truy vấn bao trọn mọi trạm
+            radius = min(radius * 2, max_radius)
+
+        # Khoảng cách (đơn vị độ) chỉ tính trên ứng viên; sắp xếp ổn định giữ thứ tự gốc khi bằng nhau
+        distances = shapely.distance(geoms.values[candidates], point)
+        nearest_positions = candidates[np.argsort(distances, kind='stable')[:limit]]
+        nearest_stops = self.stops_gdf.iloc[nearest_positions]
         
         # Trả về danh sách tên trạm (unique để tránh trùng lặp)
         return nearest_stops['name'].unique().tolist()
 
+#==================== GỢI Ý TÊN TRẠM ====================
+    def search_stop_names(self, query, limit=10):
+        """Trả về tối đa `limit` tên trạm (không trùng) chứa chuỗi `query`, không phân biệt hoa thường."""
+        if self.stops_gdf is None:
+            self.load_data()
+
+        if self._stop_name_index is None:
+            # Dựng một lần: tên duy nhất theo thứ tự xuất hiện, nối thành một chuỗi viết thường
+            # để mỗi lần gõ chỉ cần str.find trên một chuỗi thay vì lower()/contains cả cột
+            names = self.stops_gdf['name'].dropna().astype(str).unique().tolist()
+            # Offset tính trên tên đã viết thường: lower() có thể đổi độ dài chuỗi (vd. 'İ' -> 'i̇')
+            lowered = [n.lower() for n in names]
+            offsets, pos = [], 0
+            for n in lowered:
+                offsets.append(pos)
+                pos += len(n) + 1
+            blob = '\x01'.join(lowered) + '\x01'
+            self._stop_name_index = (names, offsets, blob)
+
+        names, offsets, blob = self._stop_name_index
+        query = query.lower()
+        if not query or '\x01' in query:
+            return []
+
+        results = []
+        start = blob.find(query)
+        while start != -1 and len(results) < limit:
+            i = bisect.bisect_right(offsets, start) - 1
+            results.append(names[i])
+            # Nhảy sang tên kế tiếp để mỗi tên chỉ được trả về một lần
+            next_start = offsets[i + 1] if i + 1 < len(offsets) else len(blob)
+            start = blob.find(query, next_start)
+        return results
+
 #==================== TẢI DỮ LIỆU ====================
     def load_data(self):
         """Đọc dữ liệu GeoJSON"""
         print("⏳ Đang đọc dữ liệu...")
         if os.path.exists(self.stops_file) and os.path.exists(self.routes_file):
-            self.stops_gdf = gpd.read_file(self.stops_file)
-            self.routes_gdf = gpd.read_file(self.routes_file)
+            self.stops_gdf = read_geodata(self.stops_file)
+            self.routes_gdf = read_geodata(self.routes_file)
+            self._stop_name_index = None
             print(f"✅ Đã tải {len(self.stops_gdf)} trạm và {len(self.routes_gdf)} tuyến.")
             print(f"DEBUG: Columns in routes_gdf: {self.routes_gdf.columns}")
             if not self.routes_gdf.empty:
@@ -70,6 +133,9 @@ class BusRoutingEngine:
         # Đặt lại đồ thị mỗi lần build để tránh cộng dồn các cạnh cũ
         self.graph = nx.DiGraph()
         self.route_to_stops = {}
+        self.stop_to_routes = defaultdict(dict)
+        self.node_name_index = []
+        self._name_match_cache = OrderedDict()
         self.is_built = False
 
         print("⏳ Đang xây dựng đồ thị tuyến (có thể mất vài giây)...")
@@ -77,10 +143,15 @@ class BusRoutingEngine:
         # Tạo chỉ mục không gian (Spatial Index) để truy vấn nhanh
         sindex = self.stops_gdf.sindex
 
-        # Duyệt qua từng tuyến xe buýt
-        for idx, route in self.routes_gdf.iterrows():
-            route_geom = route.geometry
-            
+        # Chuẩn bị hình học từng tuyến trước, để truy vấn trạm gần tuyến một lượt cho mọi tuyến.
+        # Lấy tên và hình học theo cột (không dựng một Series cho mỗi dòng như iterrows)
+        if 'name' in self.routes_gdf.columns:
+            route_names = self.routes_gdf['name'].tolist()
+        else:
+            route_ids = self.routes_gdf['id'].tolist() if 'id' in self.routes_gdf.columns else [None] * len(self.routes_gdf)
+            route_names = [f"Route {route_id}" for route_id in route_ids]
+        route_items = []
+        for route_name, route_geom in zip(route_names, self.routes_gdf.geometry.values):
             # Xử lý MultiLineString: cố gắng gộp thành 1 LineString
             if route_geom.geom_type == 'MultiLineString':
                 try:
@@ -98,17 +169,29 @@ class BusRoutingEngine:
             if route_geom.geom_type != 'LineString':
                 continue
 
-            route_name = route.get('name', f"Route {route.get('id')}")
-            
-            # 1. Tìm các trạm nằm gần tuyến đường này (buffer khoảng 0.0003 độ ~ 30-40m)
-            # Dùng bounding box để lọc sơ bộ trước
-            possible_matches_index = list(sindex.intersection(route_geom.bounds))
-            possible_matches = self.stops_gdf.iloc[possible_matches_index]
-            
-            # Lọc chính xác bằng khoảng cách (distance)
-            # Lưu ý: Đây là tính toán trên hệ tọa độ phẳng (độ), chỉ mang tính tương đối
-            # Giảm buffer xuống 0.0003 (~30m) để tránh bắt nhầm trạm ở đường song song hoặc chiều về
-            stops_near_route = possible_matches[possible_matches.distance(route_geom) < 0.0003].copy()
+            route_items.append((route_name, route_geom))
+
+        # 1. Tìm các trạm nằm gần tuyến (khoảng 0.0003 độ ~ 30m) cho TẤT CẢ tuyến bằng một truy vấn
+        # R-tree hàng loạt (dwithin), thay cho lọc bbox + tính distance riêng cho từng tuyến.
+        # Lưu ý: Đây là tính toán trên hệ tọa độ phẳng (độ), chỉ mang tính tương đối
+        # Giảm buffer xuống 0.0003 (~30m) để tránh bắt nhầm trạm ở đường song song hoặc chiều về
+        near_tol = 0.0003
+        route_geoms = np.array([geom for _, geom in route_items], dtype=object)
+        route_pos, stop_pos = sindex.query(route_geoms, predicate='dwithin', distance=near_tol, sort=True)
+        # Giữ đúng điều kiện cũ: trạm nằm trong bbox của tuyến và cách tuyến "< 0.0003" (dwithin là "<=")
+        stop_geoms = self.stops_gdf.geometry.values[stop_pos]
+        route_bounds = shapely.bounds(route_geoms)[route_pos]
+        stop_x, stop_y = shapely.get_x(stop_geoms), shapely.get_y(stop_geoms)
+        keep = ((stop_x >= route_bounds[:, 0]) & (stop_x <= route_bounds[:, 2])
+                & (stop_y >= route_bounds[:, 1]) & (stop_y <= route_bounds[:, 3])
+                & (shapely.distance(route_geoms[route_pos], stop_geoms) < near_tol))
+        route_pos, stop_pos = route_pos[keep], stop_pos[keep]
+        # sort=True: kết quả sắp theo (tuyến, trạm), nên searchsorted tách được từng nhóm trạm cho mỗi tuyến
+        bounds = np.searchsorted(route_pos, np.arange(len(route_items) + 1))
+
+        # Duyệt qua từng tuyến xe buýt
+        for k, (route_name, route_geom) in enumerate(route_items):
+            stops_near_route = self.stops_gdf.iloc[stop_pos[bounds[k]:bounds[k + 1]]].copy()
 
             if stops_near_route.empty:
                 continue
@@ -128,12 +211,17 @@ class BusRoutingEngine:
             # 2. Sắp xếp các trạm theo thứ tự xuất hiện trên tuyến đường
             # Project trạm lên đường thẳng để lấy khoảng cách từ điểm đầu
             stops_near_route['pos_on_line'] = stops_near_route.geometry.apply(lambda x: route_geom.project(x))
-            stops_sorted = stops_near_route.sort_values('pos_on_line')
+            # Sắp ổn định: các trạm cùng vị trí chiếu (vd. cụm trạm ở bến đầu) giữ thứ tự trạm trong dữ liệu
+            stops_sorted = stops_near_route.sort_values('pos_on_line', kind='stable')
 
             # 3. Tạo cạnh nối các trạm liên tiếp
             stop_ids = stops_sorted['id'].tolist()
             self.route_to_stops[route_name] = stop_ids # Lưu danh sách trạm của tuyến để tìm đường thẳng
             stop_names = stops_sorted['name'].tolist()
+            # Lấy sẵn cột ra list, tránh .iloc[i] dựng cả một Series cho mỗi cạnh
+            line_pos = stops_sorted['pos_on_line'].tolist()
+            stop_xs = stops_sorted.geometry.x.tolist()
+            stop_ys = stops_sorted.geometry.y.tolist()
             
             for i in range(len(stop_ids) - 1):
                 u = stop_ids[i]
@@ -141,8 +229,8 @@ class BusRoutingEngine:
                 
                 # Tính khoảng cách giữa 2 trạm (đơn vị xấp xỉ mét hoặc độ)
                 # Ở đây dùng độ dài trên line làm trọng số (weight)
-                start_dist = stops_sorted.iloc[i]['pos_on_line']
-                end_dist = stops_sorted.iloc[i+1]['pos_on_line']
+                start_dist = line_pos[i]
+                end_dist = line_pos[i+1]
                 dist = end_dist - start_dist
                 
                 # Thêm cạnh vào đồ thị
@@ -150,32 +238,42 @@ class BusRoutingEngine:
                 if self.graph.has_edge(u, v):
                     self.graph[u][v]['routes'].append(route_name)
                 else:
-                    # Cắt lấy đoạn đường thực tế giữa 2 trạm
-                    segment_geom = substring(route_geom, start_dist, end_dist)
+                    # Cắt lấy đoạn đường thực tế giữa 2 trạm, rút gọn đỉnh (GEOS Douglas-Peucker)
+                    # vì hình học cạnh chỉ dùng để vẽ lộ trình lên bản đồ
+                    segment_geom = substring(route_geom, start_dist, end_dist).simplify(
+                        self.simplify_tolerance, preserve_topology=False)
                     self.graph.add_edge(u, v, weight=dist, routes=[route_name], geometry=segment_geom)
                     
                 # Cập nhật thông tin node (tên, tọa độ)
                 # Lưu ý: add_edge tự động tạo node nếu chưa có, nhưng không có thuộc tính
                 # Nên ta cần cập nhật thuộc tính cho node dù nó đã tồn tại hay chưa
-                self.graph.add_node(u, name=stop_names[i], pos=(stops_sorted.iloc[i].geometry.x, stops_sorted.iloc[i].geometry.y))
-                self.graph.add_node(v, name=stop_names[i+1], pos=(stops_sorted.iloc[i+1].geometry.x, stops_sorted.iloc[i+1].geometry.y))
+                self.graph.add_node(u, name=stop_names[i], pos=(stop_xs[i], stop_ys[i]))
+                self.graph.add_node(v, name=stop_names[i+1], pos=(stop_xs[i+1], stop_ys[i+1]))
+
+        # Chỉ mục ngược trạm -> tuyến (kèm vị trí) để tìm tuyến thẳng bằng tra dict
+        # thay vì quét mọi tuyến và gọi list.index cho từng cặp trạm
+        for r_name, stops in self.route_to_stops.items():
+            for pos, stop_id in enumerate(stops):
+                self.stop_to_routes[stop_id].setdefault(r_name, pos)
 
         # Thêm kết nối đi bộ giữa các trạm gần nhau (ví dụ: trạm ở hai bên đường)
         bus_edge_count = self.graph.number_of_edges()
         self._add_walking_edges()
         total_edge_count = self.graph.number_of_edges()
 
+        # Chuẩn hóa tên trạm một lần thay vì gọi .lower() cho mọi node ở mỗi lần tìm đường
+        # (chuẩn hóa cả cột tên một lượt bằng pandas .str thay vì từng node trong vòng lặp Python)
+        nodes = list(self.graph.nodes)
+        names_lower = pd.Series([self.graph.nodes[n].get('name', '') for n in nodes], dtype=object).astype(str).str.lower()
+        self.node_name_index = list(zip(nodes, names_lower.tolist()))
+
         self.is_built = True
         added_walk_edges = total_edge_count - bus_edge_count
         print(f"✅ Đã xây dựng đồ thị với {self.graph.number_of_nodes()} trạm và {total_edge_count} kết nối (thêm {added_walk_edges} kết nối đi bộ).")
 
-    def _ensure_node(self, stop_row):
+    def _ensure_node(self, stop_id, name, geom):
         """Đảm bảo node tồn tại trong graph với thông tin tọa độ/tên."""
-        self.graph.add_node(
-            stop_row['id'],
-            name=stop_row.get('name', 'Unknown'),
-            pos=(stop_row.geometry.x, stop_row.geometry.y)
-        )
+        self.graph.add_node(stop_id, name=name, pos=(geom.x, geom.y))
 
     def _add_walk_edge(self, u, v, dist, geom):
         """Thêm cạnh đi bộ hai chiều nếu chưa tồn tại cạnh cùng chiều."""
@@ -190,34 +288,26 @@ class BusRoutingEngine:
 
         # 1 độ ~ 111km. Giới hạn 120m -> khoảng 0.00108 độ
         walk_threshold_deg = self.max_walk_distance_m / 111_000
-        sindex = self.stops_gdf.sindex
-        processed_pairs = set()
-
-        for idx, stop in self.stops_gdf.iterrows():
-            stop_geom = stop.geometry
-            candidate_idx = list(sindex.intersection(stop_geom.buffer(walk_threshold_deg).bounds))
-
-            for cand_idx in candidate_idx:
-                if cand_idx == idx:
-                    continue
-
-                pair_key = tuple(sorted((idx, cand_idx)))
-                if pair_key in processed_pairs:
-                    continue
-
-                neighbor = self.stops_gdf.iloc[cand_idx]
-                neighbor_geom = neighbor.geometry
-                distance = stop_geom.distance(neighbor_geom)
-
-                if 0 < distance <= walk_threshold_deg:
-                    processed_pairs.add(pair_key)
-
-                    # Đảm bảo node tồn tại và thêm cạnh đi bộ 2 chiều
-                    self._ensure_node(stop)
-                    self._ensure_node(neighbor)
-                    walk_geom = LineString([stop_geom, neighbor_geom])
-                    self._add_walk_edge(stop['id'], neighbor['id'], distance, walk_geom)
-                    self._add_walk_edge(neighbor['id'], stop['id'], distance, walk_geom)
+        geoms = self.stops_gdf.geometry.values
+        stop_ids = self.stops_gdf['id'].tolist()
+        names = self.stops_gdf['name'].tolist() if 'name' in self.stops_gdf.columns else ['Unknown'] * len(geoms)
+
+        # Một truy vấn R-tree hàng loạt (dwithin) cho mọi trạm, thay cho một truy vấn + vòng
+        # lặp Python mỗi trạm; mỗi cặp (i, j) chỉ giữ một lần với i < j
+        left, right = self.stops_gdf.sindex.query(geoms, predicate='dwithin', distance=walk_threshold_deg)
+        keep = left < right
+        left, right = left[keep], right[keep]
+        distances = shapely.distance(geoms[left], geoms[right])
+        keep = distances > 0
+        left, right, distances = left[keep], right[keep], distances[keep]
+
+        for i, j, distance in zip(left.tolist(), right.tolist(), distances.tolist()):
+            # Đảm bảo node tồn tại và thêm cạnh đi bộ 2 chiều
+            self._ensure_node(stop_ids[i], names[i], geoms[i])
+            self._ensure_node(stop_ids[j], names[j], geoms[j])
+            walk_geom = LineString([geoms[i], geoms[j]])
+            self._add_walk_edge(stop_ids[i], stop_ids[j], distance, walk_geom)
+            self._add_walk_edge(stop_ids[j], stop_ids[i], distance, walk_geom)
 
     def _label_route(self, routes_set):
         """Chọn tên tuyến để hiển thị, ưu tiên tuyến bus, fallback sang 'đi bộ'."""
@@ -255,25 +345,30 @@ class BusRoutingEngine:
         cross = direction[0] * offset[1] - direction[1] * offset[0]
         return cross
 
+    def _find_nodes_by_name(self, name):
+        """Trả về các node có tên chứa chuỗi tìm kiếm (không phân biệt hoa thường)."""
+        name_lower = name.lower()
+        # Cùng một tên trạm thường được tìm lặp lại (autocomplete, bến đầu/cuối), nên nhớ kết quả
+        # Cache có giới hạn (LRU) vì khóa đến từ input của /find_route; trả về tuple để
+        # nơi gọi không sửa được kết quả đang nằm trong cache
+        nodes = self._name_match_cache.get(name_lower)
+        if nodes is not None:
+            self._name_match_cache.move_to_end(name_lower)
+            return nodes
+        nodes = tuple(node for node, node_name in self.node_name_index if name_lower in node_name)
+        self._name_match_cache[name_lower] = nodes
+        while len(self._name_match_cache) > self.name_match_cache_size:
+            self._name_match_cache.popitem(last=False)
+        return nodes
+
     def find_shortest_path(self, start_name, end_name):
         """Tìm đường đi ngắn nhất giữa 2 tên trạm (tìm kiếm gần đúng)"""
         if not self.is_built:
             self.build_graph()
 
         # Tìm ID trạm dựa trên tên (gần đúng)
-        start_nodes = []
-        end_nodes = []
-        
-        # Chuẩn hóa tên để tìm kiếm
-        start_name_lower = start_name.lower()
-        end_name_lower = end_name.lower()
-
-        for node, data in self.graph.nodes(data=True):
-            node_name = data.get('name', '')
-            if start_name_lower in node_name.lower():
-                start_nodes.append(node)
-            if end_name_lower in node_name.lower():
-                end_nodes.append(node)
+        start_nodes = self._find_nodes_by_name(start_name)
+        end_nodes = self._find_nodes_by_name(end_name)
         
         if not start_nodes:
             return None, None, f"Không tìm thấy trạm khởi hành nào khớp với '{start_name}'"
@@ -283,14 +378,15 @@ class BusRoutingEngine:
         # --- Ưu tiên 1: Tìm tuyến đi thẳng ---
         path_ids = None
         for s in start_nodes:
+            s_routes = self.stop_to_routes.get(s, {})
             for e in end_nodes:
                 if s == e: continue
-                for r_name, stops in self.route_to_stops.items():
-                    if s in stops and e in stops:
-                        idx_s = stops.index(s)
-                        idx_e = stops.index(e)
+                e_routes = self.stop_to_routes.get(e, {})
+                for r_name, idx_s in s_routes.items():
+                    idx_e = e_routes.get(r_name)
+                    if idx_e is not None:
                         if idx_s < idx_e:
-                            p = stops[idx_s : idx_e + 1]
+                            p = self.route_to_stops[r_name][idx_s : idx_e + 1]
                             if path_ids is None or len(p) < len(path_ids):
                                 path_ids = p
                                 print(f"✨ Tìm thấy tuyến thẳng: {r_name}")
@@ -405,9 +501,8 @@ class BusRoutingEngine:
                 if 'geometry' in edge_data:
                     geom = edge_data['geometry']
                     if geom.geom_type == 'LineString':
-                        coords = list(geom.coords)
-                        latlon_coords = [[c[1], c[0]] for c in coords]
-                        full_geometry_coords.extend(latlon_coords)
+                        # Lấy cả mảng tọa độ một lần rồi đảo cột (lon, lat) -> (lat, lon) cho Leaflet
+                        full_geometry_coords.extend(shapely.get_coordinates(geom)[:, ::-1].tolist())
                 else:
                     node_data = self.graph.nodes[node_id]
                     pos = node_data.get('pos', (0, 0))
@@ -2,9 +2,12 @@ import geopandas as gpd
 import osmnx as ox
 import os
 
+from geo_io import read_geodata
+
 # === 1. Load bus stops ===
 print("Loading bus stops...")
-stops = gpd.read_file("hanoi_bus_stops_osm.geojson")
+# Prefers the GeoParquet snapshot written by api_getter when it is up to date
+stops = read_geodata("hanoi_bus_stops_osm.geojson")
 
 # === 2. Download Hanoi districts ===
 print("Downloading Hanoi district boundaries...")
@@ -0,0 +1,75 @@
+"""
+geo_io.py - Shared geodata reading helpers
+==========================================
+
+Used by bus_map, bus_routing and district_splitter so every script picks the
+same OGR engine and the same "fresh GeoParquet snapshot first" rule.
+"""
+
+import logging
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+import geopandas as gpd
+import shapely
+
+logger = logging.getLogger(__name__)
+
+# Vectorized OGR reader (returns arrays instead of iterating features in Python)
+try:
+    import pyogrio  # noqa: F401
+    READ_ENGINE: Optional[str] = "pyogrio"
+except ImportError:
+    READ_ENGINE = None  # geopandas default engine
+
+
+def fresh_parquet(path: Union[str, Path]) -> Optional[Path]:
+    """Return the ``<stem>.parquet`` sibling of ``path`` if it is not older than ``path``.
+    
+    Args:
+        path: Path to the source file (GeoJSON)
+        
+    Returns:
+        Path of the GeoParquet snapshot, or None when it is missing or stale
+        (or the source itself is missing)
+    """
+    path = Path(path)
+    parquet_path = path.with_suffix(".parquet")
+    try:
+        if parquet_path.stat().st_mtime >= path.stat().st_mtime:
+            return parquet_path
+    except OSError:
+        pass
+    return None
+
+
+def read_geodata(path: Union[str, Path],
+                 columns: Optional[List[str]] = None,
+                 bbox: Optional[Tuple[float, float, float, float]] = None,
+                 use_parquet: bool = True) -> gpd.GeoDataFrame:
+    """Read a GeoDataFrame, preferring an up-to-date GeoParquet sibling.
+    
+    Args:
+        path: Path to GeoJSON file
+        columns: Attribute columns to keep (missing names are ignored); None keeps all
+        bbox: (minx, miny, maxx, maxy) window; only features whose geometry
+            intersects the box (exact test, not just the envelope) are returned.
+            None reads everything.
+        use_parquet: Look for a ``<stem>.parquet`` snapshot (see ``fresh_parquet``)
+        
+    Returns:
+        GeoDataFrame read from the snapshot when it is fresh, otherwise from
+        the GeoJSON itself
+    """
+    parquet_path = fresh_parquet(path) if use_parquet else None
+    if parquet_path is not None:
+        logger.debug(f"Reading GeoParquet snapshot: {parquet_path.name}")
+        gdf = gpd.read_parquet(parquet_path)
+        if columns is not None:
+            gdf = gdf[[c for c in columns if c in gdf.columns] + [gdf.geometry.name]]
+        if bbox is not None:
+            # Same exact intersection test pyogrio applies to the GeoJSON read
+            gdf = gdf.iloc[gdf.sindex.query(shapely.box(*bbox), predicate='intersects', sort=True)]
+        return gdf
+    # pyogrio pushes the column and bbox filters down into GDAL, skipping unrelated features
+    return gpd.read_file(path, engine=READ_ENGINE, columns=columns, bbox=bbox)